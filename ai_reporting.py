@@ -1,14 +1,84 @@
 # ai_reporting.py - Функциональность AI-отчетов и анализа данных
 
+import os
+import re
+import json
+import functools
 import streamlit as st
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from io import BytesIO
-from fpdf import FPDF
+from typing import Any, Dict, Optional, Tuple
 
-from config import FACILITIES_COORD, OPENAI_API_KEY
+from config import FACILITIES_COORD, FACILITIES_LIST, OPENAI_API_KEY, OPENAI_MODEL, fragment
 from data_service import fetch_pollution_history, get_pollutant_name_safe
-import streamlit as st
+
+# Замены Unicode-символов, не поддерживаемых стандартными шрифтами PDF
+_UNICODE_FIXUPS = {
+    "CO₂": "CO2",
+    "NO₂": "NO2",
+    "SO₂": "SO2",
+    "O₃": "O3",
+    "PM₂.₅": "PM2.5",
+    "PM₁₀": "PM10",
+    "µg/m³": "ug/m3",
+}
+_UNICODE_RE = re.compile('|'.join(map(re.escape, _UNICODE_FIXUPS)))
+
+# Максимальное число отчетов, хранимых в кэше сессии
+REPORT_CACHE_SIZE = 8
+
+# Заголовки таблицы статистики в PDF
+_TABLE_HEADINGS = ("Pollutant", "Minimum (ug/m3)", "Average (ug/m3)", "Maximum (ug/m3)")
+
+# Стили шрифтов PDF-отчета: роль -> (начертание, размер)
+_REPORT_FONTS = {
+    "title": ("B", 16),
+    "heading": ("B", 12),
+    "caption": ("I", 10),
+    "table": ("", 9),
+    "body": ("", 10),
+    "footer": ("I", 8),
+}
+
+def aggregate_pollutant_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Считает минимальные, максимальные и средние значения по каждому загрязнителю.
+    
+    Args:
+        df: DataFrame с данными о загрязнении
+        
+    Returns:
+        DataFrame со столбцами min, max, mean, индексированный по загрязнителю
+    """
+    pollutant = df['pollutant']
+    if isinstance(pollutant.dtype, pd.CategoricalDtype):
+        # Набор категорий известен заранее: считаем за один проход по кодам без groupby
+        categories = pollutant.cat.categories
+        codes = pollutant.cat.codes.to_numpy()
+        vals = df['value'].to_numpy(dtype='float64')
+        valid = (codes >= 0) & ~np.isnan(vals)
+        codes, vals = codes[valid], vals[valid]
+        
+        n = len(categories)
+        cnt = np.bincount(codes, minlength=n)
+        total = np.bincount(codes, weights=vals, minlength=n)
+        mins = np.full(n, np.inf)
+        maxs = np.full(n, -np.inf)
+        np.minimum.at(mins, codes, vals)
+        np.maximum.at(maxs, codes, vals)
+        
+        seen = cnt > 0
+        stats = pd.DataFrame({
+            'min': mins[seen],
+            'max': maxs[seen],
+            'mean': total[seen] / cnt[seen],
+        }, index=pd.Index(categories[seen], name='pollutant'))
+        return stats.round(2)
+    
+    stats = df.groupby('pollutant', observed=True)['value'].agg(['min', 'max', 'mean'])
+    return stats.round(2)
 
 def call_openai_dummy(prompt: str) -> str:
     """
@@ -64,13 +134,62 @@ We recommend reviewing this data on a weekly basis and implementing the suggeste
     
     return report
 
-def generate_report(df: pd.DataFrame, period: str) -> str:
+def render_report_markdown(analysis: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Преобразует JSON-ответ модели в Markdown-отчет.
+    
+    Args:
+        analysis: Словарь {код загрязнителя: {reasons, benefits, recommendations}}
+        
+    Returns:
+        Текст отчета в формате Markdown
+    """
+    sections = [
+        ("reasons", "Potential Reasons for Observed Levels"),
+        ("benefits", "Health and Operational Benefits"),
+        ("recommendations", "Recommendations"),
+    ]
+    lines = ["# Air Quality Analysis Report", "", "## Analysis of Current Levels", ""]
+    for pollutant, fields in analysis.items():
+        lines.append(f"### {get_pollutant_name_safe(pollutant)} Analysis")
+        for field, title in sections:
+            items = fields.get(field, [])
+            if isinstance(items, str):
+                items = [items]
+            lines.append(f"#### {title}")
+            lines.extend(f"- {item}" for item in items)
+            lines.append("")
+    return "\n".join(lines)
+
+def call_openai(prompt: str) -> str:
+    """
+    Выполняет один запрос к OpenAI API с анализом всех загрязнителей.
+    
+    Args:
+        prompt: Текстовый запрос для AI
+        
+    Returns:
+        Текстовый отчет в формате Markdown
+    """
+    from openai import OpenAI
+    
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    response = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        response_format={"type": "json_object"},
+        messages=[{"role": "user", "content": prompt}],
+    )
+    analysis = json.loads(response.choices[0].message.content)
+    return render_report_markdown(analysis)
+
+def generate_report(df: pd.DataFrame, period: str, stats: Optional[pd.DataFrame] = None) -> str:
     """
     Генерирует аналитический отчет на основе данных о загрязнении.
     
     Args:
         df: DataFrame с данными о загрязнении
         period: Период отчета (hourly, daily, weekly)
+        stats: Предварительно рассчитанная статистика (опционально)
         
     Returns:
         Текстовый отчет с анализом
@@ -80,8 +199,9 @@ def generate_report(df: pd.DataFrame, period: str) -> str:
         st.warning("OpenAI API key is missing. Using demo mode with sample responses.")
     
     # Aggregate pollutant statistics
-    agg_df = df.groupby('pollutant')['value'].agg(['min', 'max', 'mean']).round(2)
-    agg = agg_df.to_dict(orient='index')
+    if stats is None:
+        stats = aggregate_pollutant_stats(df)
+    agg = stats.to_dict(orient='index')
     
     # Build a detailed prompt for the AI
     summary = (
@@ -92,6 +212,7 @@ def generate_report(df: pd.DataFrame, period: str) -> str:
         ]) + "."
     )
 
+    # Один запрос на все загрязнители сразу: ответ приходит JSON-объектом по кодам загрязнителей
     prompt = (
         "You are an environmental AI specialist.\n\n"
         "Analyze the pollutant level summary provided below. "
@@ -99,122 +220,165 @@ def generate_report(df: pd.DataFrame, period: str) -> str:
         "  1. Potential reasons for the observed levels\n"
         "  2. Health and operational benefits of maintaining safe levels\n"
         "  3. Actionable recommendations\n\n"
-        "Your response should be no less than 500 words, clearly structured with headings for each section.\n\n"
+        "Respond with a single JSON object keyed by pollutant code "
+        f"({', '.join(agg.keys())}). Each value must be an object with the fields "
+        "\"reasons\", \"benefits\" and \"recommendations\", each a list of detailed sentences. "
+        "The whole analysis should be no less than 500 words.\n\n"
         f"Summary:\n{summary}"
     )
 
-    # Используем заглушку вместо реального вызова OpenAI API
-    # В будущем здесь можно добавить реальный вызов OpenAI API при наличии ключа
     if OPENAI_API_KEY:
-        # TODO: Implement actual OpenAI API call here when ready
-        # For now, still using the dummy function
-        return call_openai_dummy(prompt)
-    else:
-        return call_openai_dummy(prompt)
+        try:
+            return call_openai(prompt)
+        except Exception as e:
+            st.warning(f"OpenAI request failed ({e}). Using demo mode with sample responses.")
+    return call_openai_dummy(prompt)
+
+@functools.lru_cache(maxsize=1)
+def _font_paths() -> Tuple[Optional[Tuple[str, str, str]], bool]:
+    """
+    Один раз проверяет наличие файлов шрифтов DejaVu на сервере.
+    
+    Returns:
+        Кортеж (пути к обычному, жирному и курсивному шрифтам, доступны ли все шрифты)
+    """
+    try:
+        font_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fonts')
+        paths = (
+            os.path.join(font_path, 'DejaVuSansCondensed.ttf'),
+            os.path.join(font_path, 'DejaVuSansCondensed-Bold.ttf'),
+            os.path.join(font_path, 'DejaVuSansCondensed-Oblique.ttf'),
+        )
+        return paths, all(os.path.exists(path) for path in paths)
+    except OSError:
+        return None, False
 
-def create_report_pdf(facility: str, period: str, timestamp: datetime, report_text: str, pollutant_data: pd.DataFrame) -> BytesIO:
+@functools.lru_cache(maxsize=1)
+def _report_pdf_class() -> type:
+    """
+    Создает класс PDF-документа отчета. fpdf импортируется лениво,
+    поэтому класс определяется при первом обращении и затем переиспользуется.
+    
+    Returns:
+        Подкласс FPDF с именованными стилями шрифтов
+    """
+    from fpdf import FPDF
+    
+    class _ReportPDF(FPDF):
+        """PDF-документ отчета с именованными стилями шрифтов."""
+        
+        def __init__(self, font_files: Optional[Tuple[str, str, str]] = None) -> None:
+            super().__init__()
+            self._family = "Arial"
+            self._current_font = None
+            # Шрифты DejaVu регистрируются один раз при создании документа
+            if font_files:
+                regular, bold, italic = font_files
+                self.add_font("DejaVu", "", regular)
+                self.add_font("DejaVu", "B", bold)
+                self.add_font("DejaVu", "I", italic)
+                self._family = "DejaVu"
+        
+        def use_font(self, role: str) -> None:
+            """Выбирает шрифт по роли, пропуская set_font, если стиль не изменился."""
+            font = (self._family, *_REPORT_FONTS[role])
+            if font != self._current_font:
+                self.set_font(*font)
+                self._current_font = font
+    
+    return _ReportPDF
+
+def _hash_dataframe(df: pd.DataFrame) -> int:
+    """Хэш содержимого DataFrame для ключа кэша Streamlit."""
+    return int(pd.util.hash_pandas_object(df).sum())
+
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={pd.DataFrame: _hash_dataframe})
+def create_report_pdf(facility: str, period: str, _timestamp: datetime, report_text: str, pollutant_data: pd.DataFrame,
+                      stats: Optional[pd.DataFrame] = None) -> BytesIO:
     """
     Создает PDF-отчет на основе текстового анализа и данных.
     
+    Результат кэшируется по объекту, периоду, тексту отчета и содержимому данных,
+    поэтому повторная генерация того же отчета не выполняет верстку PDF заново.
+    
     Args:
         facility: Название объекта
         period: Период отчета
-        timestamp: Временная метка создания отчета
+        _timestamp: Временная метка создания отчета (не входит в ключ кэша)
         report_text: Текстовый анализ от AI
         pollutant_data: DataFrame с данными о загрязнении
+        stats: Предварительно рассчитанная статистика (опционально)
         
     Returns:
         BytesIO объект с PDF-файлом
     """
-    try:
-        # Проверяем наличие файлов шрифтов DejaVu на сервере
-        import os
-        font_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fonts')
-        dejavu_regular = os.path.join(font_path, 'DejaVuSansCondensed.ttf')
-        dejavu_bold = os.path.join(font_path, 'DejaVuSansCondensed-Bold.ttf')
-        dejavu_italic = os.path.join(font_path, 'DejaVuSansCondensed-Oblique.ttf')
-        
-        # Если шрифты не найдены, используем стандартные шрифты и безопасные имена
-        use_custom_fonts = (os.path.exists(dejavu_regular) and 
-                           os.path.exists(dejavu_bold) and 
-                           os.path.exists(dejavu_italic))
-    except:
-        use_custom_fonts = False
-    
-    # Инициализируем простую версию PDF без специальных шрифтов
-    pdf = FPDF()
+    from fpdf.fonts import FontFace
+    
+    # Если шрифты не найдены, используем стандартные шрифты и безопасные имена
+    font_files, use_custom_fonts = _font_paths()
+    
+    pdf = _report_pdf_class()(font_files if use_custom_fonts else None)
     pdf.add_page()
     
-    # Используем базовые шрифты
-    pdf.set_font("Arial", "B", 16)
+    pdf.use_font("title")
     
     # Название
     pdf.cell(190, 10, f"Air Quality Assessment Report", ln=True, align='C')
-    pdf.set_font("Arial", "B", 12)
+    pdf.use_font("heading")
     pdf.cell(190, 10, f"{period} Report for {facility}", ln=True, align='C')
     
     # Дата и время
-    pdf.set_font("Arial", "I", 10)
-    pdf.cell(190, 10, f"Generated on: {timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')}", ln=True, align='C')
+    pdf.use_font("caption")
+    pdf.cell(190, 10, f"Generated on: {_timestamp.strftime('%Y-%m-%d %H:%M:%S UTC')}", ln=True, align='C')
     pdf.ln(5)
     
     # Добавляем статистику по загрязнителям
-    pdf.set_font("Arial", "B", 12)
+    pdf.use_font("heading")
     pdf.cell(190, 10, "Pollutant Statistics", ln=True)
     pdf.ln(2)
     
-    # Создаем таблицу
-    pdf.set_font("Arial", "", 9)
-    col_width = 45
-    row_height = 10
+    # Получаем статистику
+    if stats is None:
+        stats = aggregate_pollutant_stats(pollutant_data)
     
-    # Заголовок таблицы
-    pdf.set_fill_color(200, 220, 255)
-    pdf.cell(col_width, row_height, "Pollutant", 1, 0, 'C', True)
-    pdf.cell(col_width, row_height, "Minimum (ug/m3)", 1, 0, 'C', True)
-    pdf.cell(col_width, row_height, "Average (ug/m3)", 1, 0, 'C', True)
-    pdf.cell(col_width, row_height, "Maximum (ug/m3)", 1, 1, 'C', True)
+    # Используем безопасные имена загрязнителей, форматируем значения столбцами
+    names = stats.index.map(get_pollutant_name_safe)
+    cells = stats[['min', 'mean', 'max']].astype(str)
+    rows = [_TABLE_HEADINGS] + [(name, *values) for name, values in zip(names, cells.itertuples(index=False, name=None))]
     
-    # Получаем статистику
-    stats = pollutant_data.groupby('pollutant')['value'].agg(['min', 'max', 'mean']).round(2)
-    
-    # Данные таблицы
-    pdf.set_fill_color(255, 255, 255)
-    for pollutant, row in stats.iterrows():
-        # Используем безопасное имя загрязнителя
-        name = get_pollutant_name_safe(pollutant)
-        pdf.cell(col_width, row_height, name, 1, 0, 'C')
-        pdf.cell(col_width, row_height, str(row['min']), 1, 0, 'C')
-        pdf.cell(col_width, row_height, str(row['mean']), 1, 0, 'C')
-        pdf.cell(col_width, row_height, str(row['max']), 1, 1, 'C')
+    # Создаем таблицу одним вызовом табличного API fpdf2
+    pdf.use_font("table")
+    col_width = 45
+    row_height = 10
+    with pdf.table(
+        width=col_width * len(_TABLE_HEADINGS),
+        align="LEFT",
+        text_align="CENTER",
+        line_height=row_height,
+        headings_style=FontFace(fill_color=(200, 220, 255)),
+    ) as table:
+        for row in rows:
+            table.row(row)
     
     pdf.ln(10)
     
     # Добавляем AI-анализ
-    pdf.set_font("Arial", "B", 12)
+    pdf.use_font("heading")
     pdf.cell(190, 10, "AI Analysis and Recommendations", ln=True)
     pdf.ln(2)
     
     # Форматируем и добавляем текст отчета
-    pdf.set_font("Arial", "", 10)
-    
-    # Заменяем проблемные символы на их безопасные версии
-    safe_report = (report_text
-        .replace("CO₂", "CO2")
-        .replace("NO₂", "NO2")
-        .replace("SO₂", "SO2")
-        .replace("O₃", "O3")
-        .replace("PM₂.₅", "PM2.5")
-        .replace("PM₁₀", "PM10")
-        .replace("µg/m³", "ug/m3")
-    )
+    pdf.use_font("body")
+    
+    # Заменяем проблемные символы на их безопасные версии за один проход
+    safe_report = _UNICODE_RE.sub(lambda m: _UNICODE_FIXUPS[m.group(0)], report_text)
     
     # Разбиваем текст на строки с учетом ширины страницы
     pdf.multi_cell(190, 7, safe_report)
     
     # Добавляем нижний колонтитул
     pdf.ln(10)
-    pdf.set_font("Arial", "I", 8)
+    pdf.use_font("footer")
     pdf.cell(190, 10, "This report was generated using AI analysis and should be reviewed by a qualified environmental specialist.", ln=True, align='C')
     
     # Возвращаем PDF как байты
@@ -236,13 +400,45 @@ def create_report_pdf(facility: str, period: str, timestamp: datetime, report_te
     pdf_bytes.seek(0)
     return pdf_bytes
 
+def _get_cached_report(key: Tuple[int, str, str]) -> Optional[Tuple[str, datetime, BytesIO]]:
+    """
+    Возвращает отчет из кэша сессии и помечает его как недавно использованный.
+    
+    Args:
+        key: Кортеж (хэш данных, период, объект)
+        
+    Returns:
+        Кортеж (текст отчета, время создания, PDF) или None
+    """
+    cache = st.session_state.setdefault("_ai_report_cache", {})
+    entry = cache.pop(key, None)
+    if entry is not None:
+        cache[key] = entry
+    return entry
+
+def _put_cached_report(key: Tuple[int, str, str], entry: Tuple[str, datetime, BytesIO]) -> None:
+    """
+    Сохраняет отчет в кэш сессии, вытесняя самые старые записи сверх лимита.
+    
+    Args:
+        key: Кортеж (хэш данных, период, объект)
+        entry: Кортеж (текст отчета, время создания, PDF)
+    """
+    cache = st.session_state.setdefault("_ai_report_cache", {})
+    cache[key] = entry
+    while len(cache) > REPORT_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+@fragment
 def render_ai_insights() -> None:
     """
     Отображает страницу AI-аналитики и отчетов.
+    
+    Выполняется как фрагмент: виджеты страницы перезапускают только эту функцию.
     """
     st.header("🤖 AI Insights & Reports")
     
-    facility = st.selectbox("Select Facility", list(FACILITIES_COORD.keys()), key="ai_facility")
+    facility = st.selectbox("Select Facility", FACILITIES_LIST, key="ai_facility")
     period = st.selectbox("Select Report Period", ["Hourly", "Daily", "Weekly"], key="ai_period")
     lat, lon = FACILITIES_COORD[facility]
     hours = {'Hourly':1, 'Daily':24, 'Weekly':168}[period]
@@ -254,14 +450,25 @@ def render_ai_insights() -> None:
         
     if st.button("Generate AI Report"):
         with st.spinner("Generating AI report..."):
-            report = generate_report(df, period.lower())
+            # Повторное нажатие для тех же данных берет готовый отчет из кэша сессии
+            cache_key = (_hash_dataframe(df), period, facility)
+            cached = _get_cached_report(cache_key)
+            if cached:
+                report, timestamp, pdf_bytes = cached
+            else:
+                # Статистика считается один раз и используется и в тексте, и в PDF
+                stats = aggregate_pollutant_stats(df)
+                report = generate_report(df, period.lower(), stats=stats)
+                timestamp = datetime.utcnow()
+                pdf_bytes = None
             st.subheader(f"{period} Report for {facility}")
             st.markdown(report)
             
             try:
                 # Create PDF report
-                timestamp = datetime.utcnow()
-                pdf_bytes = create_report_pdf(facility, period, timestamp, report, df)
+                if pdf_bytes is None:
+                    pdf_bytes = create_report_pdf(facility, period, timestamp, report, df, stats=stats)
+                    _put_cached_report(cache_key, (report, timestamp, pdf_bytes))
                 
                 # Offer download button for PDF
                 st.download_button(
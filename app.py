@@ -1,17 +1,16 @@
 # app.py - Главный файл приложения
 
 import streamlit as st
-from datetime import datetime
 import time
 
 # Импортируем модули
 from config import (
     initialize_session_state, 
-    ROLES, PASSWORD, MAX_LOGIN_ATTEMPTS, 
-    DEFAULT_REFRESH_INTERVAL
+    ROLES, MAX_LOGIN_ATTEMPTS, 
+    DEFAULT_REFRESH_INTERVAL, fragment
 )
-from data_service import fetch_weather, fetch_pollution_current, fetch_pollution_history
-from streaming import start_streaming_data, stop_streaming_data
+from data_service import fetch_current_conditions, clear_history_cache, observation_time
+from streaming import start_streaming_data, stop_streaming_data, read_streaming_data
 from ui import render_header, render_weather_cards, render_pollutant_cards, render_trends
 from forecasting import render_forecast
 from ai_reporting import render_ai_insights
@@ -32,6 +31,8 @@ def render_sidebar():
         st.markdown("---")
         st.header("Settings & Logout")
         st.info(f"Logged in as: {st.session_state.role}")
+        if st.button("Refresh data", help="Discard cached history and fetch fresh data from the API"):
+            clear_history_cache()
         if st.button("Logout"):
             # Stop any streaming that might be happening
             stop_streaming_data()
@@ -54,124 +55,98 @@ def render_sidebar():
             
     return page, stream_mode, interval
 
+def render_live_data(facility: str, streaming: bool) -> None:
+    """Отображает текущие данные, предупреждения и (в потоковом режиме) время обновления"""
+    from ui import check_pollutant_alerts, display_alert_modal, apply_test_values
+    
+    # Pick up the freshest streamed record, if any
+    if streaming:
+        record = read_streaming_data()
+        if record is not None:
+            st.session_state.live_data = record
+    
+    data = st.session_state.live_data
+    
+    # Apply test values if test mode is enabled
+    pollution = apply_test_values(data["pollution"])
+    
+    render_weather_cards(data["weather"])
+    render_pollutant_cards(pollution)
+    
+    # Check for dangerous levels and display alert if needed
+    exceedances = check_pollutant_alerts(pollution)
+    if exceedances:
+        display_alert_modal(exceedances, facility)
+    
+    if streaming:
+        st.caption(f"Last updated: {data['timestamp']:%Y-%m-%d %H:%M:%S} UTC")
 
+def render_streaming_controls(lat, lon, interval) -> bool:
+    """
+    Запускает потоковое обновление и отображает его статус.
+    
+    Returns:
+        True, если поток был (пере)запущен в этом запуске скрипта
+    """
+    # Start the streaming data (restarts it if the facility or interval changed)
+    started = start_streaming_data(lat, lon, interval)
+    
+    st.info("Real-time data streaming active. Data updates every " + 
+            f"{interval} seconds without page refresh.")
+    
+    # Create a stop button
+    if st.button("Stop Real-time Updates"):
+        stop_streaming_data()
+        st.warning("Real-time updates stopped.")
+        experimental_rerun()
+    
+    return started
 
-def render_dashboard():
+def render_dashboard(streaming: bool = False, interval: int = DEFAULT_REFRESH_INTERVAL):
     """Отображение основной страницы мониторинга"""
-    from config import FACILITIES_COORD
-    from ui import render_weather_cards, render_pollutant_cards, render_trends
-    from ui import check_pollutant_alerts, display_alert_modal
-    from ui import add_test_controls, apply_test_values
+    from config import FACILITIES_COORD, FACILITIES_LIST
+    from ui import add_test_controls
     
     # Initialize test mode in session state if not present
     if 'test_mode' not in st.session_state:
         st.session_state.test_mode = False
     
-    facility = st.selectbox("Select Facility", list(FACILITIES_COORD.keys()))
+    facility = st.selectbox("Select Facility", FACILITIES_LIST)
     st.session_state.selected_facility = facility
     lat, lon = FACILITIES_COORD[facility]
     st.subheader(f"📍 {facility}")
     
     # Create containers for live-updating data
-    weather_container = st.container()
-    pollutant_container = st.container()
+    live_container = st.container()   # Weather, pollutants and alerts
     trends_container = st.container()
-    alert_container = st.container()  # New container for alerts
     test_container = st.container()   # Container for test controls
     
     # Add testing controls
     with test_container:
         add_test_controls()
     
-    # Get initial data
-    try:
-        weather = fetch_weather(lat, lon)
-        current = fetch_pollution_current(lat, lon)
-        
-        # Apply test values if test mode is enabled
-        current = apply_test_values(current)
-        
-    except Exception as e:
-        st.error(f"Fetch error: {e}")
-        return
+    started = render_streaming_controls(lat, lon, interval) if streaming else False
     
-    # Check for dangerous levels and display alert if needed
-    with alert_container:
-        exceedances = check_pollutant_alerts(current)
-        if exceedances:
-            display_alert_modal(exceedances, facility)
-    
-    # Render initial data
-    render_weather_cards(weather, weather_container)
-    render_pollutant_cards(current, pollutant_container)
-    render_trends(lat, lon, container=trends_container)
-    
-    return lat, lon, weather_container, pollutant_container, alert_container
-
-def render_streaming_dashboard(lat, lon, interval, weather_container, pollutant_container, alert_container):
-    """Отображает панель мониторинга с обновлением в реальном времени"""
-    from ui import check_pollutant_alerts, display_alert_modal
-    from ui import apply_test_values
-    
-    # Start the streaming data
-    start_streaming_data(lat, lon, interval)
-    
-    # Create a placeholder for last update time
-    last_update = st.empty()
-    
-    # Start the streaming UI update loop
-    streaming_status = st.empty()
-    streaming_status.info("Real-time data streaming active. Data updates every " + 
-                         f"{interval} seconds without page refresh.")
-    
-    # Create a stop button
-    if st.button("Stop Real-time Updates"):
-        stop_streaming_data()
-        streaming_status.warning("Real-time updates stopped.")
-        st.experimental_rerun()
-    
-    # This will run in the main thread and continuously check for new data
-    counter = 0
-    placeholder = st.empty()
-    
-    while st.session_state.streaming_active:
+    # Get initial data. While streaming, keep the last streamed record across
+    # reruns unless the stream was just (re)started for new parameters
+    if not streaming or started or st.session_state.get("live_data") is None:
         try:
-            # Check if there's new data in the queue
-            if not st.session_state.stream_data_queue.empty():
-                data = st.session_state.stream_data_queue.get()
-                weather = data["weather"]
-                pollution = data["pollution"]
-                timestamp = data["timestamp"]
-                
-                # Apply test values if test mode is enabled
-                pollution = apply_test_values(pollution)
-                
-                # Update the displayed data
-                with weather_container:
-                    render_weather_cards(weather)
-                
-                with pollutant_container:
-                    render_pollutant_cards(pollution)
-                
-                # Check for alerts with every data update
-                with alert_container:
-                    exceedances = check_pollutant_alerts(pollution)
-                    if exceedances:
-                        display_alert_modal(exceedances, st.session_state.selected_facility)
-                
-                # Update the timestamp
-                last_update.caption(f"Last updated: {timestamp:%Y-%m-%d %H:%M:%S} UTC")
-                
-                # Show a pulsing indicator during updates
-                counter += 1
-                animation = ["⏳", "⌛", "⏳", "⌛"][counter % 4]
-                placeholder.text(f"{animation} Live data streaming active...")
-            
-            # Short sleep to prevent UI freezing
-            time.sleep(0.1)
+            weather, current = fetch_current_conditions(lat, lon)
         except Exception as e:
-            st.error(f"Error updating streaming data: {e}")
-            time.sleep(5)
+            st.error(f"Fetch error: {e}")
+            return
+        st.session_state.live_data = {
+            "weather": weather,
+            "pollution": current,
+            "timestamp": observation_time(weather)
+        }
+    
+    # In streaming mode only this fragment reruns on every tick;
+    # trends and the rest of the page are not redrawn
+    with live_container:
+        fragment(run_every=interval if streaming else None)(render_live_data)(facility, streaming)
+    
+    render_trends(lat, lon, container=trends_container)
 
 def main():
     """Основная функция приложения"""
@@ -188,21 +163,16 @@ def main():
     render_header() 
 
     if page == 'Dashboard':
-        # Обновлено: теперь функция возвращает контейнер для алертов
-        lat, lon, weather_container, pollutant_container, alert_container = render_dashboard()
-        
         # Handle different update modes
         if stream_mode == "Real-time Streaming":
-            # Обновлено: передаем контейнер для алертов
-            render_streaming_dashboard(lat, lon, interval, weather_container, pollutant_container, alert_container)
-        elif stream_mode == "Page Refresh":
-            # Stop any existing streaming
-            stop_streaming_data()
-            time.sleep(interval)
-            experimental_rerun()
-        else:  # Manual mode
+            render_dashboard(streaming=True, interval=interval)
+        else:
             # Stop any existing streaming
             stop_streaming_data()
+            render_dashboard()
+            if stream_mode == "Page Refresh":
+                time.sleep(interval)
+                experimental_rerun()
             
     elif page == 'Forecast':
         # Stop any streaming that might be happening when we leave the dashboard
@@ -1,7 +1,8 @@
 # auth.py - Функции аутентификации и авторизации
 
+import bcrypt
 import streamlit as st
-from config import ROLES, PASSWORD, MAX_LOGIN_ATTEMPTS
+from config import ROLES, PASSWORD_HASH, MAX_LOGIN_ATTEMPTS
 
 # Безопасный перезапуск Streamlit
 try:
@@ -10,6 +11,22 @@ except ImportError:
     def experimental_rerun():
         st.stop()
 
+def check_password(pwd: str) -> bool:
+    """
+    Проверяет пароль по bcrypt-хэшу (сравнение за постоянное время).
+    
+    Args:
+        pwd: Введенный пароль
+        
+    Returns:
+        True, если пароль верный
+    """
+    try:
+        return bcrypt.checkpw(pwd.encode("utf-8"), PASSWORD_HASH)
+    except ValueError:
+        # bcrypt отклоняет пароли длиннее 72 байт и некорректный хэш
+        return False
+
 def show_login() -> None:
     """
     Отображает страницу входа и обрабатывает аутентификацию пользователя.
@@ -29,7 +46,7 @@ def show_login() -> None:
     if st.button("Login"):
         if st.session_state.login_attempts >= MAX_LOGIN_ATTEMPTS:
             st.error("Access locked. Too many attempts.")
-        elif pwd == PASSWORD:
+        elif check_password(pwd):
             st.session_state.logged_in = True
             st.session_state.login_error = False
             st.session_state.role = role
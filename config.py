@@ -1,12 +1,14 @@
 # config.py - Настройки и конфигурация приложения
 
 import streamlit as st
-import queue
-from typing import Dict, Tuple, List, Any
+import os
+import re
+from typing import Dict, Tuple, List, Any, Callable, Optional
 
 # === API KEYS ===
 API_KEY = st.secrets.get("OPENWEATHER_API_KEY", "")
 OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY", "")
+OPENAI_MODEL = st.secrets.get("OPENAI_MODEL", "gpt-4o-mini")
 
 # === COORDINATES AND SETTINGS ===
 FACILITIES_COORD: Dict[str, Tuple[float, float]] = {
@@ -15,6 +17,7 @@ FACILITIES_COORD: Dict[str, Tuple[float, float]] = {
     "Gas Terminal C": (42.8820, 74.5827),
     "Storage Site D": (43.2220, 76.8512)
 }
+FACILITIES_LIST: List[str] = list(FACILITIES_COORD.keys())
 
 POLLUTANTS: List[str] = ["co", "no", "no2", "o3", "so2", "pm2_5", "pm10"]
 
@@ -24,7 +27,13 @@ HAZARD_THRESHOLDS: Dict[str, int] = {
 
 # === USER ROLES AND AUTHENTICATION ===
 ROLES: List[str] = ["Admin", "Engineer", "Safety", "Viewer"]
-PASSWORD: str = "123"
+# bcrypt-хэш пароля входа; можно переопределить через PASSWORD_HASH в .streamlit/secrets.toml
+PASSWORD_HASH: bytes = st.secrets.get(
+    "PASSWORD_HASH", "$2b$12$rAxrrKwk70dhTkP1VOS0vuWlP2Onls8yl6L6pVNA2CkdidxMYkxdC"
+).strip().encode("utf-8")
+# Проверяем формат хэша один раз при загрузке: с неверным хэшем любой вход отклоняется
+if not re.fullmatch(rb"\$2[abxy]?\$\d{2}\$[./A-Za-z0-9]{53}", PASSWORD_HASH):
+    print("PASSWORD_HASH is not a valid bcrypt hash; all login attempts will be rejected")
 MAX_LOGIN_ATTEMPTS: int = 3
 
 # === APP SETTINGS ===
@@ -32,6 +41,15 @@ DEFAULT_REFRESH_INTERVAL: int = 120
 HISTORY_HOURS: int = 24
 FORECAST_HOURS: int = 24
 MODEL_HISTORY_HOURS: int = 168
+HISTORY_CACHE_DIR: str = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".cache")
+# Потоковый процесс завершается сам, если UI не забирал данные дольше этого времени (сек,
+# но не меньше двух интервалов обновления плюс STREAM_IDLE_MARGIN)
+# (например, вкладка закрыта); 300 с переживают троттлинг таймеров фоновых вкладок
+STREAM_IDLE_TIMEOUT: int = 300
+# Запас к двум интервалам обновления: UI обновляет отметку активности раз в интервал (сек)
+STREAM_IDLE_MARGIN: int = 60
+# Сколько ждать штатного завершения потокового процесса перед terminate (сек)
+STREAM_JOIN_TIMEOUT: float = 2.0
 
 # === COLOR AND VISUALIZATION SETTINGS ===
 POLLUTANT_COLORS: Dict[str, str] = {
@@ -44,6 +62,16 @@ POLLUTANT_COLORS: Dict[str, str] = {
     "pm10": "rgba(128,0,128,0.8)"
 }
 
+# === STREAMLIT COMPATIBILITY ===
+def _fragment_fallback(func: Optional[Callable] = None, **kwargs: Any) -> Callable:
+    """Заглушка для версий Streamlit без фрагментов: функция выполняется как обычно."""
+    if func is None:
+        return lambda f: f
+    return func
+
+# st.fragment (Streamlit >= 1.37) перезапускает только декорированную функцию
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or _fragment_fallback
+
 # === SESSION STATE INITIALIZATION ===
 def initialize_session_state() -> None:
     """Инициализирует переменные состояния сессии Streamlit"""
@@ -53,10 +81,14 @@ def initialize_session_state() -> None:
         "role": None,
         "login_attempts": 0,
         "streaming_active": False,
-        "stream_data_queue": queue.Queue(),
+        "stream_process": None,
+        "stream_stop_event": None,
+        "stream_data_queue": None,
+        "stream_heartbeat": None,
+        "stream_params": None,
         "selected_facility": None
     }
     
     for key, default in default_states.items():
         if key not in st.session_state:
-            st.session_state[key] = default
\ No newline at end of file
+            st.session_state[key] = default
@@ -1,13 +1,72 @@
 # data_service.py - Сервис для получения данных API
 
+import os
+import glob
+import time
+import functools
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from typing import Dict, Any, List
-from config import API_KEY
+from typing import Dict, Any, List, Optional, Tuple
+from config import API_KEY, POLLUTANTS, HISTORY_CACHE_DIR
+from kernels import resample_hourly
 
-@st.cache_data(ttl=600)
+# Отображаемые названия и цвета загрязнителей
+_POLLUTANT_INFO: Dict[str, Tuple[str, str]] = {
+    "co": ("CO", "rgba(102,197,207,0.8)"),
+    "no": ("NO", "rgba(197,90,17,0.8)"),
+    "no2": ("NO₂", "rgba(30,144,255,0.8)"),
+    "o3": ("O₃", "rgba(255,165,0,0.8)"),
+    "so2": ("SO₂", "rgba(105,105,105,0.8)"),
+    "pm2_5": ("PM₂.₅", "rgba(0,128,0,0.8)"),
+    "pm10": ("PM₁₀", "rgba(128,0,128,0.8)")
+}
+
+# Названия загрязнителей без Unicode-индексов (для PDF)
+_POLLUTANT_NAME_SAFE: Dict[str, str] = {
+    "co": "CO",
+    "no": "NO",
+    "no2": "NO2",
+    "o3": "O3",
+    "so2": "SO2",
+    "pm2_5": "PM2.5",
+    "pm10": "PM10"
+}
+
+# Контекст Streamlit нужен рабочим потокам, чтобы st.error отображался на странице
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    def get_script_run_ctx():
+        return None
+
+    def add_script_run_ctx(thread=None, ctx=None):
+        return thread
+
+# Общая HTTP-сессия: keep-alive соединения переиспользуются между запросами к OpenWeather,
+# временные ошибки (429/5xx) повторяются с экспоненциальной задержкой
+_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods={"GET"}
+)
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_RETRY))
+
+# Время жизни исторических данных и почасовых рядов в кэше, с
+HISTORY_CACHE_TTL: int = 300
+
+# Таймаут на установку соединения отдельно от таймаута чтения
+CONNECT_TIMEOUT: float = 3.05
+
+@st.cache_data(ttl=600, show_spinner=False)
 def fetch_pollution_current(lat: float, lon: float) -> Dict[str, float]:
     """
     Получает текущие данные о загрязнении воздуха.
@@ -20,17 +79,84 @@ def fetch_pollution_current(lat: float, lon: float) -> Dict[str, float]:
         Словарь с данными о загрязнителях
     """
     if not API_KEY:
-        st.error("OpenWeather API key is missing. Please set it in .streamlit/secrets.toml")
         return {}
         
     url = "http://api.openweathermap.org/data/2.5/air_pollution"
     params = {"lat": lat, "lon": lon, "appid": API_KEY}
-    r = requests.get(url, params=params, timeout=5)
+    r = _SESSION.get(url, params=params, timeout=(CONNECT_TIMEOUT, 5))
     r.raise_for_status()
     data = r.json().get("list", [])
     return data[0].get("components", {}) if data else {}
 
-@st.cache_data(ttl=600)
+def _pollutant_categories(pols: List[str]) -> List[str]:
+    """
+    Возвращает категории загрязнителей: сначала фиксированный список POLLUTANTS,
+    затем прочие компоненты из ответа API (например, nh3).
+    
+    Args:
+        pols: Коды загрязнителей из ответа API
+        
+    Returns:
+        Упорядоченный список категорий
+    """
+    return POLLUTANTS + sorted(set(pols).difference(POLLUTANTS))
+
+def _history_cache_path(lat: float, lon: float, hours: int, end_hour: int) -> str:
+    """
+    Возвращает путь к parquet-снимку истории для заданного места, глубины и часа.
+    
+    Args:
+        lat: Широта местоположения
+        lon: Долгота местоположения
+        hours: Количество часов истории
+        end_hour: Конец периода в часах от начала эпохи
+        
+    Returns:
+        Путь к файлу кэша
+    """
+    return os.path.join(HISTORY_CACHE_DIR, f"pollution_history_{lat}_{lon}_{hours}h_{end_hour}.parquet")
+
+def _read_history_cache(path: str) -> Optional[pd.DataFrame]:
+    """
+    Читает снимок истории с диска.
+    
+    Args:
+        path: Путь к файлу кэша
+        
+    Returns:
+        DataFrame из кэша или None, если снимка нет или его не удалось прочитать
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path, engine="pyarrow")
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed to read history cache {path}: {e}")
+        return None
+
+def _write_history_cache(path: str, df: pd.DataFrame) -> None:
+    """
+    Сохраняет снимок истории на диск и удаляет устаревшие снимки того же запроса.
+    
+    Args:
+        path: Путь к файлу кэша
+        df: DataFrame с историческими данными
+    """
+    try:
+        os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+        df.to_parquet(path, engine="pyarrow")
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed to write history cache {path}: {e}")
+        return
+    prefix = path.rsplit("_", 1)[0]
+    for stale in glob.glob(f"{prefix}_*.parquet"):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL, show_spinner=False)
 def fetch_pollution_history(lat: float, lon: float, hours: int) -> pd.DataFrame:
     """
     Получает исторические данные о загрязнении воздуха.
@@ -49,21 +175,82 @@ def fetch_pollution_history(lat: float, lon: float, hours: int) -> pd.DataFrame:
         
     end = int(datetime.utcnow().timestamp())
     start = end - hours * 3600
+    
+    # Второй уровень кэша: снимок на диске, общий для перезапусков и всех сессий
+    cache_file = _history_cache_path(lat, lon, hours, end // 3600)
+    cached = _read_history_cache(cache_file)
+    if cached is not None:
+        return cached
+    
     url = "http://api.openweathermap.org/data/2.5/air_pollution/history"
     params = {"lat": lat, "lon": lon, "start": start, "end": end, "appid": API_KEY}
-    r = requests.get(url, params=params, timeout=10)
+    r = _SESSION.get(url, params=params, timeout=(CONNECT_TIMEOUT, 10))
     r.raise_for_status()
-    recs = []
+    # Собираем данные по столбцам, а не списком словарей; метки времени
+    # преобразуются в datetime64 одним векторным вызовом
+    ts, pols, vals = [], [], []
     for ent in r.json().get("list", []):
-        dt = datetime.utcfromtimestamp(ent.get("dt", 0))
+        dt = ent.get("dt", 0)
         for pol, val in ent.get("components", {}).items():
-            recs.append({"datetime": dt, "pollutant": pol, "value": val})
-    df = pd.DataFrame(recs)
+            ts.append(dt)
+            pols.append(pol)
+            vals.append(val)
+    df = pd.DataFrame({
+        "datetime": pd.to_datetime(np.asarray(ts, dtype="int64"), unit="s", utc=True),
+        "pollutant": pd.Categorical(pols, categories=_pollutant_categories(pols)),
+        "value": np.asarray(vals, dtype="float32")
+    })
     if not df.empty:
         df = df.set_index('datetime').sort_index()
+        _write_history_cache(cache_file, df)
     return df
 
-@st.cache_data(ttl=300)
+def clear_history_cache() -> None:
+    """
+    Сбрасывает все уровни кэша исторических данных: кэш Streamlit,
+    почасовые ряды в состоянии сессии и снимки на диске.
+    """
+    fetch_pollution_history.clear()
+    for key in [k for k in st.session_state.keys() if str(k).startswith("hist_")]:
+        del st.session_state[key]
+    for path in glob.glob(os.path.join(HISTORY_CACHE_DIR, "pollution_history_*.parquet")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def fetch_pollution_series(lat: float, lon: float, hours: int) -> Dict[str, pd.Series]:
+    """
+    Возвращает почасовые ряды средних значений по каждому загрязнителю.
+    
+    История разбивается на ряды один раз и хранится в состоянии сессии,
+    поэтому повторные перезапуски не фильтруют весь DataFrame заново.
+    Часы без наблюдений остаются NaN, чтобы вызывающий код мог оценить
+    долю пропусков перед заполнением.
+    
+    Args:
+        lat: Широта местоположения
+        lon: Долгота местоположения
+        hours: Количество часов истории
+        
+    Returns:
+        Словарь {код загрязнителя: почасовой ряд значений (NaN в часы без данных)}
+    """
+    key = f"hist_{lat}_{lon}_{hours}"
+    cached = st.session_state.get(key)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < HISTORY_CACHE_TTL:
+        return cached[1]
+    
+    df = fetch_pollution_history(lat, lon, hours)
+    series = {}
+    if not df.empty:
+        series = {str(k): resample_hourly(g['value'], ffill=False)
+                  for k, g in df.groupby('pollutant', sort=False, observed=True)}
+    st.session_state[key] = (now, series)
+    return series
+
+@st.cache_data(ttl=300, show_spinner=False)
 def fetch_weather(lat: float, lon: float) -> Dict[str, Any]:
     """
     Получает текущие данные о погоде.
@@ -76,15 +263,57 @@ def fetch_weather(lat: float, lon: float) -> Dict[str, Any]:
         Словарь с данными о погоде
     """
     if not API_KEY:
-        st.error("OpenWeather API key is missing. Please set it in .streamlit/secrets.toml")
         return {}
         
     url = "http://api.openweathermap.org/data/2.5/weather"
     params = {"lat": lat, "lon": lon, "units": "metric", "appid": API_KEY}
-    r = requests.get(url, params=params, timeout=5)
+    r = _SESSION.get(url, params=params, timeout=(CONNECT_TIMEOUT, 5))
     r.raise_for_status()
     return r.json()
 
+def fetch_current_conditions(lat: float, lon: float,
+                             executor: Optional[ThreadPoolExecutor] = None) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Параллельно получает текущую погоду и текущие данные о загрязнении.
+    
+    Args:
+        lat: Широта местоположения
+        lon: Долгота местоположения
+        executor: Пул потоков для повторного использования (опционально);
+            если не передан, создается временный пул
+        
+    Returns:
+        Кортеж (данные о погоде, данные о загрязнителях)
+    """
+    # Запросы выполняются в рабочих потоках, которые не пишут в интерфейс:
+    # сообщение об ошибке выводится один раз из вызывающего потока
+    if not API_KEY:
+        st.error("OpenWeather API key is missing. Please set it in .streamlit/secrets.toml")
+        return {}, {}
+    if executor is None:
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)) as ex:
+            return fetch_current_conditions(lat, lon, executor=ex)
+    f_weather = executor.submit(fetch_weather, lat, lon)
+    f_pollution = executor.submit(fetch_pollution_current, lat, lon)
+    return f_weather.result(), f_pollution.result()
+
+def observation_time(weather: Dict[str, Any]) -> datetime:
+    """
+    Возвращает время измерения текущей погоды (поле dt ответа OpenWeather).
+    
+    Ответы API кэшируются, поэтому время запроса не отражает свежесть данных.
+    
+    Args:
+        weather: Данные о погоде
+        
+    Returns:
+        Время измерения в UTC (текущее время, если поле отсутствует)
+    """
+    dt = weather.get("dt")
+    return datetime.utcfromtimestamp(dt) if dt else datetime.utcnow()
+
+@functools.lru_cache(maxsize=32)
 def pollutant_info(key: str) -> tuple:
     """
     Возвращает информацию о загрязнителе по его ключу.
@@ -95,15 +324,9 @@ def pollutant_info(key: str) -> tuple:
     Returns:
         Кортеж (название для отображения, цвет)
     """
-    mapping = {"co": ("CO", "rgba(102,197,207,0.8)"),
-               "no": ("NO", "rgba(197,90,17,0.8)"),
-               "no2": ("NO₂", "rgba(30,144,255,0.8)"),
-               "o3": ("O₃", "rgba(255,165,0,0.8)"),
-               "so2": ("SO₂", "rgba(105,105,105,0.8)"),
-               "pm2_5": ("PM₂.₅", "rgba(0,128,0,0.8)"),
-               "pm10": ("PM₁₀", "rgba(128,0,128,0.8)")}
-    return mapping.get(key, (key.upper(), "rgba(150,150,150,0.8)"))
+    return _POLLUTANT_INFO.get(key, (key.upper(), "rgba(150,150,150,0.8)"))
 
+@functools.lru_cache(maxsize=32)
 def get_pollutant_name_safe(key: str) -> str:
     """
     Возвращает безопасную для Unicode версию названия загрязнителя.
@@ -114,11 +337,4 @@ def get_pollutant_name_safe(key: str) -> str:
     Returns:
         Безопасное название загрязнителя
     """
-    mapping = {"co": "CO", 
-               "no": "NO",
-               "no2": "NO2",
-               "o3": "O3",
-               "so2": "SO2",
-               "pm2_5": "PM2.5",
-               "pm10": "PM10"}
-    return mapping.get(key, key.upper())
\ No newline at end of file
+    return _POLLUTANT_NAME_SAFE.get(key, key.upper())
\ No newline at end of file
@@ -1,6 +1,9 @@
 # forecasting.py - Функциональность для прогнозирования загрязнения
 
+import os
+import threading
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime
@@ -8,12 +11,87 @@ from statsmodels.tsa.statespace.sarimax import SARIMAX
 import warnings
 from statsmodels.tools.sm_exceptions import ConvergenceWarning
 
-from config import FACILITIES_COORD, POLLUTANTS, MODEL_HISTORY_HOURS, FORECAST_HOURS, HAZARD_THRESHOLDS
-from data_service import fetch_pollution_history
+from config import FACILITIES_COORD, FACILITIES_LIST, POLLUTANTS, MODEL_HISTORY_HOURS, FORECAST_HOURS, HAZARD_THRESHOLDS
+from data_service import fetch_pollution_series
+from kernels import downsample, HOUR_NS
 
 # Игнорируем предупреждения о сходимости для упрощения пользовательского интерфейса
 warnings.simplefilter('ignore', ConvergenceWarning)
 
+# ARIMA из statsforecast (numba JIT) быстрее SARIMAX; используем его, если установлен.
+# Скомпилированный numba-код сохраняется на диск между перезапусками.
+os.environ.setdefault("NIXTLA_NUMBA_CACHE", "1")
+try:
+    from statsforecast.models import ARIMA
+except ImportError:
+    ARIMA = None
+
+# Максимальное число точек наблюдений на графике прогноза
+MAX_PLOT_POINTS = 1000
+
+# Минимальная длина ряда (ч) и максимальная доля пропусков для сезонной модели
+MIN_SEASONAL_HOURS = 3 * 24
+MAX_FILL_RATIO = 0.3
+
+# Смещения часов прогноза от последнего наблюдения, нс
+_FORECAST_OFFSETS_NS = np.arange(1, FORECAST_HOURS + 1, dtype=np.int64) * HOUR_NS
+
+# Уровень доверительного интервала прогноза, %
+CONFIDENCE_LEVEL = 95
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fit_sarimax(values: np.ndarray, seasonal: bool = True) -> np.ndarray:
+    """
+    Обучает модель SARIMA и строит прогноз на FORECAST_HOURS часов.
+    Использует ARIMA из statsforecast, если он установлен, иначе SARIMAX из statsmodels.
+    
+    Кэшируется по значениям ряда, поэтому повторные перезапуски страницы
+    с теми же данными не обучают модель заново.
+    
+    Args:
+        values: Почасовые значения загрязнителя
+        seasonal: Использовать ли суточную сезонную составляющую
+        
+    Returns:
+        Массив формы (FORECAST_HOURS, 3): средний прогноз, нижняя и верхняя граница интервала
+    """
+    if ARIMA is not None:
+        model = ARIMA(order=(1, 1, 1), season_length=24,
+                      seasonal_order=(1, 1, 1) if seasonal else (0, 0, 0))
+        model.fit(values)
+        fc = model.predict(h=FORECAST_HOURS, level=[CONFIDENCE_LEVEL])
+        return np.column_stack([fc['mean'], fc[f'lo-{CONFIDENCE_LEVEL}'], fc[f'hi-{CONFIDENCE_LEVEL}']])
+
+    model = SARIMAX(
+        values,
+        order=(1, 1, 1),
+        seasonal_order=(1, 1, 1, 24) if seasonal else (0, 0, 0, 0),
+        enforce_stationarity=False,
+        enforce_invertibility=False
+    )
+    res = model.fit(disp=False)
+    forecast = res.get_forecast(steps=FORECAST_HOURS)
+    summary = forecast.summary_frame(alpha=1 - CONFIDENCE_LEVEL / 100)
+    return summary[['mean', 'mean_ci_lower', 'mean_ci_upper']].to_numpy()
+
+def warm_up_forecasting() -> None:
+    """
+    Компилирует JIT-код ARIMA на небольшом синтетическом ряде,
+    чтобы первый прогноз пользователя не тратил время на компиляцию.
+    """
+    if ARIMA is None:
+        return
+    try:
+        dummy = np.sin(np.arange(96) * 2 * np.pi / 24)
+        ARIMA(order=(1, 1, 1), season_length=24, seasonal_order=(1, 1, 1)).fit(dummy)
+    except Exception as e:
+        print(f"ARIMA warm-up failed: {e}")
+
+# Модуль импортируется один раз на процесс; компиляция идет в фоновом потоке
+# и не задерживает первую страницу (в том числе страницу входа)
+if ARIMA is not None:
+    threading.Thread(target=warm_up_forecasting, name="arima-warm-up", daemon=True).start()
+
 def render_forecast() -> None:
     """
     Отображает страницу прогнозирования загрязнения с моделью SARIMA.
@@ -21,71 +99,67 @@ def render_forecast() -> None:
     st.header("🔮 SARIMA Forecast")
     
     # Выбор объекта и загрязнителя
-    facility = st.selectbox("Select Facility for Forecast", list(FACILITIES_COORD.keys()), key="fc_facility")
+    facility = st.selectbox("Select Facility for Forecast", FACILITIES_LIST, key="fc_facility")
     pollutant = st.selectbox("Select Pollutant", POLLUTANTS, key="fc_pollutant")
     lat, lon = FACILITIES_COORD[facility]
+    threshold = HAZARD_THRESHOLDS.get(pollutant)
     
     # Получение исторических данных
-    df = fetch_pollution_history(lat, lon, MODEL_HISTORY_HOURS)
-    if df.empty:
+    history = fetch_pollution_series(lat, lon, MODEL_HISTORY_HOURS)
+    series = history.get(pollutant)
+    if series is None or series.empty:
         st.error("Insufficient historical data for modeling.")
         return
 
-    # Подготовка данных для моделирования
-    series = df[df['pollutant'] == pollutant]['value']
-    series = series.resample('1H').mean().ffill()
+    # На коротком или разреженном ряде суточная сезонность плохо оценивается:
+    # обучаем модель без сезонной составляющей (меньше размерность фильтра Калмана)
+    observed_hours = int(series.notna().sum())
+    fill_ratio = 1 - observed_hours / len(series)
+    seasonal = observed_hours >= MIN_SEASONAL_HOURS and fill_ratio <= MAX_FILL_RATIO
+    series = series.ffill()
 
     st.write(f"Training SARIMA model on last {MODEL_HISTORY_HOURS}h of {pollutant.upper()}")
     
-    # Обучение модели SARIMA
+    # Обучение модели SARIMA (результат кэшируется между перезапусками скрипта)
     try:
-        model = SARIMAX(
-            series,
-            order=(1, 1, 1),
-            seasonal_order=(1, 1, 1, 24),
-            enforce_stationarity=False,
-            enforce_invertibility=False
-        )
-        res = model.fit(disp=False)
+        with st.spinner("Fitting forecast model..."):
+            fc = _fit_sarimax(series.to_numpy(dtype='float64'), seasonal)
     except Exception as e:
         st.error(f"Model fitting error: {e}")
         return
 
-    # Получение прогноза
-    forecast = res.get_forecast(steps=FORECAST_HOURS)
-    fc_index = pd.date_range(start=series.index[-1] + pd.Timedelta(hours=1),
-                            periods=FORECAST_HOURS, freq='1H')
-    fc_mean = forecast.predicted_mean
-    conf = forecast.conf_int()
+    # Получение прогноза: одна таблица используется и для графика, и для вывода, и для проверки порогов
+    fc_index = pd.DatetimeIndex(
+        (series.index[-1].value + _FORECAST_OFFSETS_NS).astype('datetime64[ns]'), tz=series.index.tz
+    )
+    df_fc = pd.DataFrame(fc, columns=['Forecast', 'Lower CI', 'Upper CI'], index=fc_index)
+    fc_mean, conf = fc[:, 0], fc[:, 1:]
 
     # Построение графика
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=series.index, y=series, mode='lines', name='Observed'))
+    # Наблюдения прореживаются для браузера; прогноз и интервал остаются полными
+    observed = downsample(series, MAX_PLOT_POINTS)
+    fig.add_trace(go.Scatter(x=observed.index, y=observed.values, mode='lines', name='Observed'))
     fig.add_trace(go.Scatter(x=fc_index, y=fc_mean, mode='lines', name='Forecast'))
+    fc_times = fc_index.values
     fig.add_trace(go.Scatter(
-        x=list(fc_index) + list(fc_index[::-1]),
-        y=list(conf.iloc[:,0]) + list(conf.iloc[:,1][::-1]),
+        x=np.concatenate([fc_times, fc_times[::-1]]),
+        y=np.concatenate([conf[:,0], conf[:,1][::-1]]),
         fill='toself', showlegend=False
     ))
     fig.update_layout(template='plotly_dark', xaxis_title='UTC Time', yaxis_title='µg/m³')
     st.plotly_chart(fig, use_container_width=True)
 
     # Отображение данных прогноза
-    df_fc = pd.DataFrame({
-        'Forecast': fc_mean.values,
-        'Lower CI': conf.iloc[:,0].values,
-        'Upper CI': conf.iloc[:,1].values
-    }, index=fc_index)
     st.dataframe(df_fc)
 
     # Проверка на превышение пороговых значений
     st.markdown("---")
     st.subheader("⚠️ Hazardous Level Alerts")
-    threshold = HAZARD_THRESHOLDS.get(pollutant)
     if threshold:
-        over = df_fc['Forecast'] > threshold
+        over = fc_mean > threshold
         if over.any():
-            times = ', '.join([t.strftime('%Y-%m-%d %H:%M') for t in df_fc[over].index])
+            times = ', '.join(df_fc.index[over].strftime('%Y-%m-%d %H:%M'))
             st.error(f"Forecasted {pollutant.upper()} exceeds {threshold} µg/m³ at: {times} UTC")
         else:
             st.success(f"No forecasted {pollutant.upper()} exceed the threshold of {threshold} µg/m³.")
@@ -0,0 +1,115 @@
+# kernels.py - Вычислительные ядра на numba для обработки временных рядов
+
+import numpy as np
+import pandas as pd
+
+# numba необязательна: без нее используются эквивалентные операции pandas.
+# Ядра объявлены с явными сигнатурами, поэтому компилируются при импорте модуля
+# (а не при первом запросе пользователя) и кэшируются на диск (cache=True).
+# Каталог кэша задается переменной окружения NUMBA_CACHE_DIR.
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+HOUR_NS: int = 3_600_000_000_000
+HOUR: pd.Timedelta = pd.Timedelta(hours=1)
+
+def _kernel_array(values: np.ndarray, dtype: type) -> np.ndarray:
+    """
+    Приводит массив к типу и виду, ожидаемому сигнатурами ядер
+    (pandas может возвращать массивы только для чтения).
+
+    Args:
+        values: Исходный массив
+        dtype: Требуемый тип элементов
+
+    Returns:
+        Изменяемый массив требуемого типа (копия только при необходимости)
+    """
+    return np.require(values, dtype=dtype, requirements=['W'])
+
+@njit('f8[:](i8[:], f8[:], i8, i8, b1)', cache=True, nogil=True)
+def resample_hourly_mean(ts_ns, vals, start_ns, n_hours, ffill):
+    """
+    Усредняет значения по часовым интервалам, при необходимости заполняя
+    пустые интервалы предыдущим значением.
+
+    Args:
+        ts_ns: Метки времени в наносекундах (int64)
+        vals: Значения (float64)
+        start_ns: Начало первого часового интервала в наносекундах
+        n_hours: Количество часовых интервалов
+        ffill: Заполнять ли пустые интервалы предыдущим значением
+
+    Returns:
+        Массив средних значений длиной n_hours
+    """
+    sums = np.zeros(n_hours)
+    counts = np.zeros(n_hours, dtype=np.int64)
+    for i in range(ts_ns.shape[0]):
+        v = vals[i]
+        if np.isnan(v):
+            continue
+        b = (ts_ns[i] - start_ns) // HOUR_NS
+        if 0 <= b < n_hours:
+            sums[b] += v
+            counts[b] += 1
+    out = np.empty(n_hours)
+    last = np.nan
+    for b in range(n_hours):
+        if counts[b] > 0:
+            last = sums[b] / counts[b]
+            out[b] = last
+        elif ffill:
+            out[b] = last
+        else:
+            out[b] = np.nan
+    return out
+
+def resample_hourly(series: pd.Series, ffill: bool = True) -> pd.Series:
+    """
+    Аналог series.resample(HOUR).mean() (с .ffill() при ffill=True) на numba-ядре.
+
+    Args:
+        series: Ряд значений с DatetimeIndex
+        ffill: Заполнять ли пустые часы предыдущим значением
+
+    Returns:
+        Почасовой ряд средних значений
+    """
+    if not NUMBA_AVAILABLE or series.empty:
+        hourly = series.resample(HOUR).mean()
+        return hourly.ffill() if ffill else hourly
+    series = series.sort_index()
+    start = series.index[0].floor(HOUR)
+    n_hours = int((series.index[-1].floor(HOUR) - start) // HOUR) + 1
+    values = resample_hourly_mean(
+        _kernel_array(series.index.as_unit('ns').asi8, np.int64),
+        _kernel_array(series.to_numpy(), np.float64),
+        start.value, n_hours, ffill
+    )
+    index = pd.date_range(start=start, periods=n_hours, freq=HOUR, name=series.index.name)
+    return pd.Series(values, index=index, name=series.name)
+
+def downsample(series: pd.Series, n_out: int) -> pd.Series:
+    """
+    Прореживает ряд для отображения на графике, оставляя каждую k-ю точку.
+
+    Args:
+        series: Ряд значений с DatetimeIndex
+        n_out: Максимальное количество точек
+
+    Returns:
+        Ряд не длиннее n_out точек
+    """
+    if len(series) <= n_out:
+        return series
+    step = -(-len(series) // n_out)
+    return series.iloc[::step]
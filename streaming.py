@@ -1,42 +1,91 @@
 # streaming.py - Функционал потокового обновления данных
 
 import streamlit as st
-import threading
+import multiprocessing
+import queue
 import time
-from datetime import datetime
-from data_service import fetch_weather, fetch_pollution_current
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from config import STREAM_IDLE_TIMEOUT, STREAM_IDLE_MARGIN, STREAM_JOIN_TIMEOUT
+from data_service import fetch_current_conditions, observation_time
 
-def fetch_data_for_streaming(lat: float, lon: float, interval: int) -> None:
+# Процесс запускается из потока Streamlit внутри многопоточного сервера: fork в таком
+# состоянии небезопасен (блокировки, пул потоков numba, общие keep-alive сокеты
+# HTTP-сессии), поэтому очередь, событие и процесс создаются из контекста spawn
+_MP = multiprocessing.get_context("spawn")
+
+def _drop_pending(data_queue: multiprocessing.Queue) -> None:
     """
-    Фоновая функция для периодического получения данных и их помещения в очередь.
+    Удаляет непрочитанную запись из очереди.
+    
+    Очередь вмещает не более одной записи, поэтому достаточно одного get_nowait;
+    у multiprocessing.Queue нет внутреннего deque, который можно очистить целиком.
+    
+    Args:
+        data_queue: Очередь потоковых данных
+    """
+    try:
+        data_queue.get_nowait()
+    except queue.Empty:
+        pass
+
+def fetch_data_for_streaming(lat: float, lon: float, interval: int,
+                             data_queue: multiprocessing.Queue, stop_event: multiprocessing.Event,
+                             heartbeat: Any, idle_timeout: float) -> None:
+    """
+    Фоновая функция дочернего процесса: периодически получает данные и помещает их в очередь.
+    
+    Работает в отдельном процессе, поэтому не конкурирует с UI-потоком Streamlit за GIL
+    и не обращается к st.session_state: остановка передается через stop_event.
+    Если UI не забирает данные дольше idle_timeout (сессия закрыта),
+    процесс завершается сам.
     
     Args:
         lat: Широта местоположения
         lon: Долгота местоположения
         interval: Интервал обновления в секундах
+        data_queue: Межпроцессная очередь для передачи данных в UI
+        stop_event: Событие остановки потока данных
+        heartbeat: Общее значение с временем последнего чтения очереди UI
+        idle_timeout: Время без чтения очереди, после которого процесс завершается (сек)
     """
-    while st.session_state.streaming_active:
-        try:
-            weather = fetch_weather(lat, lon)
-            pollution = fetch_pollution_current(lat, lon)
-            timestamp = datetime.utcnow()
-            
-            # Put the new data in the queue
-            st.session_state.stream_data_queue.put({
-                "weather": weather,
-                "pollution": pollution,
-                "timestamp": timestamp
-            })
-            
-            # Sleep for the specified interval
-            time.sleep(interval)
-        except Exception as e:
-            print(f"Error in data streaming thread: {e}")
-            time.sleep(5)  # Retry after a short delay
+    # Цикл процесса только планирует запросы; сетевой ввод-вывод выполняет
+    # пул потоков, который живет все время работы процесса
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        while not stop_event.is_set():
+            if time.time() - heartbeat.value > idle_timeout:
+                break
+            try:
+                weather, pollution = fetch_current_conditions(lat, lon, executor=executor)
+                timestamp = observation_time(weather)
+                
+                # Replace any unread record so the UI always gets the freshest sample
+                _drop_pending(data_queue)
+                try:
+                    data_queue.put_nowait({
+                        "weather": weather,
+                        "pollution": pollution,
+                        "timestamp": timestamp
+                    })
+                except queue.Full:
+                    # An unread record is still in transit; the next tick replaces it
+                    pass
+                
+                # Wait for the specified interval, waking up early on stop
+                stop_event.wait(interval)
+            except Exception as e:
+                print(f"Error in data streaming process: {e}")
+                stop_event.wait(5)  # Retry after a short delay
+
+def _stream_alive() -> bool:
+    """Проверяет, работает ли потоковый процесс текущей сессии."""
+    process = st.session_state.get("stream_process")
+    return process is not None and process.is_alive()
 
 def start_streaming_data(lat: float, lon: float, interval: int) -> bool:
     """
-    Запуск фонового потока для регулярного получения данных.
+    Запуск фонового процесса для регулярного получения данных.
+    Работающий процесс перезапускается, если изменились координаты или интервал.
     
     Args:
         lat: Широта местоположения
@@ -44,24 +93,76 @@ def start_streaming_data(lat: float, lon: float, interval: int) -> bool:
         interval: Интервал обновления в секундах
         
     Returns:
-        True при успешном запуске потока, иначе False
+        True, если процесс был (пере)запущен, иначе False
     """
-    if not st.session_state.streaming_active:
-        st.session_state.streaming_active = True
-        # Clear any existing data in the queue
-        while not st.session_state.stream_data_queue.empty():
-            st.session_state.stream_data_queue.get()
-        
-        # Start the background thread
-        thread = threading.Thread(
-            target=fetch_data_for_streaming,
-            args=(lat, lon, interval),
-            daemon=True
-        )
-        thread.start()
-        return True
-    return False
+    params = (lat, lon, interval)
+    if st.session_state.streaming_active and _stream_alive() and st.session_state.stream_params == params:
+        return False
+    
+    # The previous process may have exited on its own (idle timeout, error)
+    # or may be polling another facility or interval
+    stop_streaming_data()
+    st.session_state.streaming_active = True
+    st.session_state.stream_params = params
+    
+    # Holds a single record, so the UI always gets the freshest sample
+    data_queue = _MP.Queue(maxsize=1)
+    stop_event = _MP.Event()
+    heartbeat = _MP.Value('d', time.time(), lock=False)
+    # UI reads the queue once per interval, so the timeout must span several ticks
+    idle_timeout = max(STREAM_IDLE_TIMEOUT, 2 * interval + STREAM_IDLE_MARGIN)
+    process = _MP.Process(
+        target=fetch_data_for_streaming,
+        args=(lat, lon, interval, data_queue, stop_event, heartbeat, idle_timeout),
+        daemon=True
+    )
+    process.start()
+    st.session_state.stream_data_queue = data_queue
+    st.session_state.stream_stop_event = stop_event
+    st.session_state.stream_heartbeat = heartbeat
+    st.session_state.stream_process = process
+    return True
+
+def read_streaming_data() -> Optional[Dict[str, Any]]:
+    """
+    Забирает последнюю запись потокового процесса и отмечает, что сессия жива.
+    Если процесс завершился (ошибка, простой), он перезапускается с прежними параметрами.
+    
+    Returns:
+        Словарь с ключами weather, pollution, timestamp или None, если новых данных нет
+    """
+    params = st.session_state.get("stream_params")
+    if st.session_state.streaming_active and params is not None and not _stream_alive():
+        print("Streaming process exited unexpectedly; restarting it")
+        start_streaming_data(*params)
+        return None
+    heartbeat = st.session_state.get("stream_heartbeat")
+    if heartbeat is not None:
+        heartbeat.value = time.time()
+    data_queue = st.session_state.get("stream_data_queue")
+    if data_queue is None:
+        return None
+    try:
+        return data_queue.get_nowait()
+    except queue.Empty:
+        return None
 
 def stop_streaming_data() -> None:
-    """Остановка фонового потока обновления данных."""
-    st.session_state.streaming_active = False
\ No newline at end of file
+    """Остановка фонового процесса обновления данных и освобождение его ресурсов."""
+    st.session_state.streaming_active = False
+    stop_event = st.session_state.get("stream_stop_event")
+    if stop_event is not None:
+        stop_event.set()
+    process = st.session_state.get("stream_process")
+    if process is not None:
+        # The process wakes up from stop_event.wait at once, unless a request is in flight
+        process.join(STREAM_JOIN_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        process.close()
+    data_queue = st.session_state.get("stream_data_queue")
+    if data_queue is not None:
+        data_queue.close()
+    for key in ("stream_process", "stream_stop_event", "stream_data_queue", "stream_heartbeat", "stream_params"):
+        st.session_state[key] = None
@@ -4,16 +4,20 @@ import streamlit as st
 import plotly.graph_objects as go
 from datetime import datetime
 from typing import Dict, Any, Optional, List
+import numpy as np
 import pandas as pd
 import os
 
 from data_service import pollutant_info, fetch_pollution_history
-from config import HISTORY_HOURS, HAZARD_THRESHOLDS
+from kernels import HOUR
+from config import HISTORY_HOURS, HAZARD_THRESHOLDS, POLLUTANTS, fragment
 
-def render_header() -> None:
-    """Отображает заголовок приложения и CSS стили."""
-    # Add custom CSS for alerts
-    st.markdown("""
+# Пороги опасных уровней, выровненные по порядку POLLUTANTS (inf - порог не задан)
+_THRESHOLDS = np.array([HAZARD_THRESHOLDS.get(p, np.inf) for p in POLLUTANTS], dtype=np.float64)
+
+# CSS-стили предупреждений. Streamlit удаляет элементы, не выведенные при перезапуске,
+# поэтому стили выводятся при каждом запуске скрипта, а не один раз за сессию
+_HEADER_CSS = """
     <style>
     .danger-alert {
         background-color: #ffebee;
@@ -43,7 +47,12 @@ def render_header() -> None:
         font-size: 1.1em;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def render_header() -> None:
+    """Отображает заголовок приложения и CSS стили."""
+    # Add custom CSS for alerts
+    st.markdown(_HEADER_CSS, unsafe_allow_html=True)
     
     st.title("🏭 Real-Time Industry Air Quality Dashboard")
     st.caption(f"Role: {st.session_state.role} | Last updated: {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC")
@@ -94,8 +103,12 @@ def render_trends(lat: float, lon: float, hours: int = HISTORY_HOURS, container:
     if df.empty:
         target.write("No historical data.")
         return
-    df['label'] = df['pollutant'].map(lambda k: pollutant_info(k)[0])
-    piv = df.groupby('label')['value'].resample('1H').mean().unstack(level=0).ffill()
+    df['label'] = df['pollutant'].map({k: pollutant_info(k)[0] for k in df['pollutant'].unique()})
+    # Одна хэш-агрегация по (час, загрязнитель) вместо groupby + resample + unstack
+    piv = (df.assign(hour=df.index.floor(HOUR))
+             .pivot_table(index='hour', columns='label', values='value', aggfunc='mean', observed=True)
+             .asfreq(HOUR)
+             .ffill())
     fig = go.Figure()
     for col in piv.columns:
         fig.add_trace(go.Scatter(x=piv.index, y=piv[col], mode='lines+markers', name=col))
@@ -114,14 +127,12 @@ def check_pollutant_alerts(pollutants: dict, container=None) -> list:
         Список превышений в формате [(загрязнитель, значение, порог), ...]
     """
     target = container if container else st
-    exceedances = []
     
-    for pollutant, value in pollutants.items():
-        threshold = HAZARD_THRESHOLDS.get(pollutant)
-        if threshold and float(value) > threshold:
-            exceedances.append((pollutant, value, threshold))
+    # Одно векторное сравнение со всеми порогами сразу
+    vals = np.array([pollutants.get(p, np.nan) for p in POLLUTANTS], dtype=np.float64)
+    exceeded = np.flatnonzero(vals > _THRESHOLDS)
     
-    return exceedances
+    return [(POLLUTANTS[i], pollutants[POLLUTANTS[i]], HAZARD_THRESHOLDS[POLLUTANTS[i]]) for i in exceeded]
 
 def display_alert_modal(exceedances: list, facility_name: str) -> None:
     """
@@ -143,6 +154,13 @@ def display_alert_modal(exceedances: list, facility_name: str) -> None:
     if not exceedances:
         return
     
+    # Resolve display names once and reuse them for the HTML and the email text
+    rows = [(pollutant_info(p)[0], v, t) for p, v, t in exceedances]
+    items_html = "".join(
+        f"<li><strong>{name}:</strong> {value} µg/m³ (exceeds threshold of {threshold} µg/m³)</li>"
+        for name, value, threshold in rows
+    )
+    
     # Create HTML for styled alert - combined into one complete HTML string
     alert_html = f"""
     <div class="danger-alert">
@@ -150,16 +168,7 @@ def display_alert_modal(exceedances: list, facility_name: str) -> None:
         <div class="alert-body">
             <p><strong>Facility:</strong> {facility_name}</p>
             <p><strong>Threshold Exceedances:</strong></p>
-            <ul>
-    """
-    
-    # Add each exceedance to the HTML
-    for pollutant, value, threshold in exceedances:
-        name, _ = pollutant_info(pollutant)
-        alert_html += f"<li><strong>{name}:</strong> {value} µg/m³ (exceeds threshold of {threshold} µg/m³)</li>"
-    
-    alert_html += """
-            </ul>
+            <ul>{items_html}</ul>
             <p><strong>Immediate action required!</strong></p>
         </div>
     </div>
@@ -180,7 +189,7 @@ def display_alert_modal(exceedances: list, facility_name: str) -> None:
         message = st.text_area(
             "Additional Information:", 
             value=f"Dangerous pollutant levels detected at {facility_name} facility. Immediate inspection required.\n\nExceedances detected:\n" + 
-                  "\n".join([f"- {pollutant_info(p)[0]}: {v} µg/m³ (threshold: {t} µg/m³)" for p, v, t in exceedances]),
+                  "\n".join(f"- {name}: {value} µg/m³ (threshold: {threshold} µg/m³)" for name, value, threshold in rows),
             height=150
         )
     
@@ -235,10 +244,14 @@ def display_alert_modal(exceedances: list, facility_name: str) -> None:
             st.session_state.alert_sent = True
             st.info("Auto-alert would be sent if email service was configured.")
 
+@fragment
 def add_test_controls(container=None):
     """
     Adds controls to simulate dangerous pollution levels for testing alerts.
     
+    Runs as a fragment, so editing the test controls does not rerun the whole dashboard;
+    applying or disabling test values reruns the app so the cards are redrawn.
+    
     Args:
         container: Optional Streamlit container for output
     """
@@ -273,14 +286,14 @@ def add_test_controls(container=None):
                 st.session_state.test_mode = True
                 st.session_state.test_pollutant = test_pollutant
                 st.session_state.test_value = test_value
-                st.success(f"Test mode activated for {test_pollutant} with value {test_value}")
-                st.info("The simulated dangerous levels will appear when you return to the dashboard")
+                # Rerun the whole app so the cards and alerts pick up the test values
+                st.rerun()
         else:
             # Disable test mode if checkbox is unchecked
             if st.session_state.get('test_mode', False):
                 if st.button("Disable Test Mode"):
                     st.session_state.test_mode = False
-                    st.success("Test mode disabled - returning to real data")
+                    st.rerun()
 
 def apply_test_values(pollutants):
     """